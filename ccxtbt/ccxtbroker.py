@@ -22,7 +22,7 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
 import collections
-import json
+import concurrent.futures
 import threading
 import time
 
@@ -33,15 +33,41 @@ from pprint import pprint
 
 from backtrader import BrokerBase, OrderBase, Order
 from backtrader.position import Position
-from backtrader.utils.py3 import queue, with_metaclass
+from backtrader.utils.date import date2num
+from backtrader.utils.py3 import with_metaclass
 
 from ccxt.base.errors import NetworkError, ExchangeError
 
+# Debug dumps are indented by 2 either way, the only indent orjson supports
+try:
+    import orjson
+
+    def _dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+except ImportError:
+    import json
+
+    def _dumps(obj):
+        return json.dumps(obj, indent=2)
+
 from .ccxtstore import BINANCEUSDM, CCXTStore
 
 BINANCEUSDM = 'binanceusdm'
 
+# Maps an endpoint address like 'order/{id}/cancel' to its implicit method name
+_ENDPOINT_TABLE = str.maketrans({'/': '_', '{': '', '}': ''})
+
+# backtrader date number of 1970-01-01 (days since 0001-01-01, plus one)
+_EPOCH_NUM = date2num(datetime(1970, 1, 1))
+
+# Fields of a created order needed to track it without fetching it again
+_ORDER_FIELDS = ('id', 'status', 'side', 'amount', 'filled')
+
 class CCXTOrder(OrderBase):
+    # No __slots__: OrderBase instances keep a __dict__ and fall back to the
+    # order params through __getattr__, so slots would save nothing here.
+    # size/ordtype must also be set before OrderBase.__init__, which reads them.
+
     def __init__(self, owner, data, ccxt_order):
         self.owner = owner
         self.data = data
@@ -122,7 +148,8 @@ class CCXTBroker(with_metaclass(MetaCCXTBroker, BrokerBase)):
 
     (TRADE, FILLED, PARTIALLY_FILLED, NEW, CANCELED, BUY, SELL) = ('TRADE', 'FILLED', 'PARTIALLY_FILLED', 'NEW', 'CANCELED', 'BUY', 'SELL')
 
-    def __init__(self, broker_mapping=None, debug=False, **kwargs):
+    def __init__(self, broker_mapping=None, debug=False, poll_interval=1.0, poll_max=10.0,
+                 keepalive=True, fast_path=False, rest_workers=1, **kwargs):
         super(CCXTBroker, self).__init__()
 
         if broker_mapping is not None:
@@ -139,16 +166,17 @@ class CCXTBroker(with_metaclass(MetaCCXTBroker, BrokerBase)):
 
         self.currency = self.store.currency
 
-        self.positions = collections.defaultdict(Position)
+        self.positions = {}  # Position per data name, created on first use
 
         self.debug = debug
-        self.indent = 4  # For pretty printing dictionaries
 
-        self.notifs = queue.Queue()  # holds orders which are notified
+        self.notifs = collections.deque()  # holds orders which are notified
 
         # self.open_orders = list()
         self.open_orders = {}
 
+        self._comminfo_cache = {}  # commission info per data name
+
         params = {}
         if self.store.exchange.id == 'bitfinex':
             params['type'] = 'derivatives'
@@ -157,23 +185,114 @@ class CCXTBroker(with_metaclass(MetaCCXTBroker, BrokerBase)):
         self.startingcash = self.store._cash
         self.startingvalue = self.store._value
 
-        self._lock_orders = threading.Lock()  # control access
-    
+        # Balance is refreshed over REST at most once every _balance_ttl seconds
+        self._balance_ts = 0
+        self._balance_ttl = 10
+
+        # State kept from Binance ACCOUNT_UPDATE events, see push_account_update
+        self._wallet_balance = None
+        self._unrealized = {}  # (market id, position side) -> unrealized profit
+        self._market_names = {}  # market id -> data name of the orders placed
+
+        self._orders_lock = threading.Lock()  # guards open_orders and positions
+
+        # Fills of an order can still be buffered or in flight on the websocket
+        # when it is cancelled. Recently cancelled orders are kept to book them.
+        self._canceled_orders = collections.OrderedDict()
+        self._canceled_keep = 100
+
+        # Mappings do not change after construction, avoid nested lookups per call
+        self._closed_key = self.mappings['closed_order']['key']
+        self._closed_val = self.mappings['closed_order']['value']
+        self._canceled_key = self.mappings['canceled_order']['key']
+        self._canceled_val = self.mappings['canceled_order']['value']
+
+        # Websocket trade messages are buffered and processed in batches so that
+        # a burst of fills costs a single lock acquisition and REST refresh
+        self._msg_buffer = collections.deque()
+        self._msg_event = threading.Event()
+        self._msg_max_wait = 0.05  # seconds to let a burst accumulate
+        self._msg_thread = None
+        self._msg_running = False
+
+        # Exchanges without a websocket feed of fills poll the open orders over
+        # REST, backing off from poll_interval up to poll_max while nothing changes
+        self._poll_interval = poll_interval
+        self._poll_max = poll_max
+        self._poll_stop = threading.Event()
+        self._poll_thread = None
+
+        self.keepalive = keepalive
+        # Place orders via CCXTStore.fast_create_order where the exchange supports it
+        self.fast_path = fast_path
+
+        # Per-symbol/per-order REST calls run serially unless rest_workers > 1.
+        # All workers share one sync ccxt instance whose rate limit throttle is
+        # not thread-safe, and retry only sleeps rateLimit before each call, so
+        # concurrent calls reach the exchange in bursts. Only raise this for
+        # exchanges whose rate limits allow it.
+        self._rest_workers = rest_workers
+        self._rest_pool = None
+
     def start(self):
         super(CCXTBroker, self).start()
         self.store.start(broker=self)
 
+        if self.keepalive:
+            self.store.start_keepalive()
+
+        if self._rest_workers > 1:
+            self._rest_pool = concurrent.futures.ThreadPoolExecutor(max_workers=self._rest_workers)
+
+        if self.store.exchange.id == BINANCEUSDM:
+            # Seed the wallet balance that ACCOUNT_UPDATE changes are applied to
+            self.get_balance(force=True)
+            self._msg_running = True
+            self._msg_thread = threading.Thread(target=self._consume_trade_messages, daemon=True)
+            self._msg_thread.start()
+        elif self.store.exchange.has.get('fetchOrder'):
+            self._poll_stop.clear()
+            self._poll_thread = threading.Thread(target=self._poll_open_orders, daemon=True)
+            self._poll_thread.start()
+
     def stop(self):
         super(CCXTBroker, self).stop()
-        self.get_balance()
+        if self._msg_thread is not None:
+            self._msg_running = False
+            self._msg_event.set()
+            self._msg_thread.join()
+            self._msg_thread = None
+        if self._poll_thread is not None:
+            self._poll_stop.set()
+            self._poll_thread.join()
+            self._poll_thread = None
+        if self._rest_pool is not None:
+            self._rest_pool.shutdown(wait=True)
+            self._rest_pool = None
+        self.get_balance(force=True)
         self.store.stop()
 
-    def get_balance(self):
-        self.store.get_balance()
+    def get_balance(self, force=False):
+        # Only hit the exchange if the cached balance is stale. In between,
+        # push_account_update keeps the store's cash/value updated.
+        if force or time.monotonic() - self._balance_ts >= self._balance_ttl:
+            balance = self.store.get_balance()
+            self._balance_ts = time.monotonic()
+            if self.store.exchange.id == BINANCEUSDM:
+                # cash is rebased, later wallet changes are applied on top of the
+                # wallet balance of this snapshot
+                self._wallet_balance = self._rest_wallet_balance(balance)
         self.cash = self.store._cash
         self.value = self.store._value
         return self.cash, self.value
 
+    def _rest_wallet_balance(self, balance):
+        # The raw Binance USD-M account response lists the wallet balance per asset
+        for asset in (balance.get('info') or {}).get('assets') or ():
+            if asset.get('asset') == self.currency:
+                return float(asset['walletBalance'])
+        return None
+
     def get_wallet_balance(self, currency, params={}):
         balance = self.store.get_wallet_balance(currency, params=params)
         cash = balance['free'][currency] if balance['free'][currency] else 0
@@ -193,19 +312,25 @@ class CCXTBroker(with_metaclass(MetaCCXTBroker, BrokerBase)):
         self.value = self.store._value
         return self.value
 
+    def addcommissioninfo(self, comminfo, name=None):
+        super(CCXTBroker, self).addcommissioninfo(comminfo, name=name)
+        self._comminfo_cache.clear()
+
     def get_notification(self):
         try:
-            return self.notifs.get(False)
-        except queue.Empty:
+            return self.notifs.popleft()
+        except IndexError:
             return None
 
     def notify(self, order):
-        self.notifs.put(order.clone())
-        # self.notifs.put(order)
+        self.notifs.append(order.clone())
+        # self.notifs.append(order)
 
     def getposition(self, data, clone=True):
         # return self.o.getposition(data._dataname, clone=clone)
-        pos = self.positions[data._dataname]
+        pos = self.positions.get(data._dataname)
+        if pos is None:
+            pos = self.positions[data._dataname] = Position()
         if clone:
             pos = pos.clone()
         return pos
@@ -213,26 +338,34 @@ class CCXTBroker(with_metaclass(MetaCCXTBroker, BrokerBase)):
 
     
     def next(self):
-        self.notifs.put(None)
+        self.notifs.append(None)
         if self.debug:
             print('Broker next() called')
 
     def _submit(self, owner, data, exectype, side, amount, price, params):
-        with self._lock_orders:
+        with self._orders_lock:
             order_type = self.order_types.get(exectype) if exectype else 'market'
-            created = int(data.datetime.datetime(0).timestamp()*1000)
+            # Convert the raw backtrader date number straight to epoch ms
+            created = int(round((data.datetime[0] - _EPOCH_NUM) * 86400000))
             # Extract CCXT specific params if passed to the order
             params = params['params'] if 'params' in params else params
             params['created'] = created  # Add timestamp of order creation for backtesting
-            ret_ord = self.store.create_order(symbol=data.p.dataname, order_type=order_type, side=side,
-                                            amount=amount, price=price, params=params)
-
-            _order = self.store.fetch_order(ret_ord['id'], data.p.dataname)
+            create_order = self.store.fast_create_order if self.fast_path else self.store.create_order
+            ret_ord = create_order(symbol=data.p.dataname, order_type=order_type, side=side,
+                                   amount=amount, price=price, params=params)
+
+            # The order returned on creation is normally complete. Only re-fetch
+            # it if the exchange left out the fields the broker relies on.
+            if all(ret_ord.get(field) is not None for field in _ORDER_FIELDS):
+                _order = ret_ord
+            else:
+                _order = self.store.fetch_order(ret_ord['id'], data.p.dataname)
 
             order = CCXTOrder(owner, data, _order)
             order.price = ret_ord['price']
 
             self.open_orders[order.ccxt_order['id']] = order
+            self._market_names[self.store.exchange.market_id(data.p.dataname)] = data.p.dataname
 
             self.notify(order)
             return order
@@ -255,39 +388,102 @@ class CCXTBroker(with_metaclass(MetaCCXTBroker, BrokerBase)):
 
     def cancel(self, order):
 
-        with self._lock_orders:
+        with self._orders_lock:
             oID = order.ccxt_order['id']
 
             if self.debug:
                 print('Broker cancel() called')
-                print('Fetching Order ID: {}'.format(oID))
+                print('Cancelling Order ID: {}'.format(oID))
 
-            # check first if the order has already been filled otherwise an error
-            # might be raised if we try to cancel an order that is not open.
-            ccxt_order = self.store.fetch_order(oID, order.data.p.dataname)
+            # Already filled or cancelled as far as the broker knows
+            if oID not in self.open_orders:
+                return order
 
-            if self.debug:
-                print(json.dumps(ccxt_order, indent=self.indent))
+            # Without a websocket feed of fills, fills made since the last poll
+            # are only known from the order returned here and must be booked
+            # before the order leaves open_orders
+            polled = self.store.exchange.id != BINANCEUSDM
 
-            if ccxt_order[self.mappings['closed_order']['key']] == self.mappings['closed_order']['value']:
-                return order
+            try:
+                ccxt_order = self.store.cancel_order(oID, order.data.p.dataname)
+            except ExchangeError:
+                # The order may have been filled before the cancel reached the
+                # exchange. Only then is it worth fetching the order to confirm.
+                ccxt_order = self.store.fetch_order(oID, order.data.p.dataname)
 
-            ccxt_order = self.store.cancel_order(oID, order.data.p.dataname)
+                if self.debug:
+                    print(_dumps(ccxt_order))
+
+                filled = ccxt_order.get(self._closed_key) == self._closed_val
+                # Cancelled already, e.g. by the exchange or an earlier attempt
+                canceled = ccxt_order.get('status') == 'canceled'
+                if not (filled or canceled):
+                    raise
+
+                if polled:
+                    self._update_polled_order(oID, order, ccxt_order)
+                elif canceled and self._pop_canceled(oID) is not None:
+                    order.cancel()
+                    self.notify(order)
+                return order
 
             if self.debug:
-                print(json.dumps(ccxt_order, indent=self.indent))
-                print('Value Received: {}'.format(ccxt_order[self.mappings['canceled_order']['key']]))
-                print('Value Expected: {}'.format(self.mappings['canceled_order']['value']))
+                print(_dumps(ccxt_order))
+                print('Value Received: {}'.format(ccxt_order[self._canceled_key]))
+                print('Value Expected: {}'.format(self._canceled_val))
+
+            filled = polled and oID in self.open_orders and self._execute_polled_fill(order, ccxt_order)
 
-            if ccxt_order[self.mappings['canceled_order']['key']] == self.mappings['canceled_order']['value']:
-                self.open_orders.pop(oID)
+            # The order may already have been removed by a fill processed meanwhile
+            if ccxt_order[self._canceled_key] == self._canceled_val and \
+                    self._pop_canceled(oID) is not None:
                 order.cancel()
                 self.notify(order)
+            elif filled:
+                order.partial()
+                self.notify(order)
 
             return order
 
-    def get_orders_open(self, safe=False):
-        return self.store.fetch_open_orders()
+    def _pop_canceled(self, oID):
+        order = self.open_orders.pop(oID, None)
+        if order is not None and self.store.exchange.id == BINANCEUSDM:
+            self._canceled_orders[oID] = order
+            while len(self._canceled_orders) > self._canceled_keep:
+                self._canceled_orders.popitem(last=False)
+        return order
+
+    def get_orders_open(self, safe=False, symbols=None):
+        if not symbols:
+            return self.store.fetch_open_orders()
+
+        # One request per symbol, in parallel if rest_workers allows it
+        open_orders = []
+        for symbol, orders, error in self._rest_calls(self.store.fetch_open_orders,
+                                                      [(symbol, (symbol,)) for symbol in symbols]):
+            if error is not None:
+                raise error
+            open_orders.extend(orders)
+        return open_orders
+
+    def _rest_calls(self, method, calls):
+        '''
+        Calls ``method(*args)`` for every ``(key, args)`` in ``calls``, serially
+        or on the REST pool when it is running. Yields ``(key, result, error)``
+        as the calls complete.
+        '''
+        if self._rest_pool is None:
+            for key, args in calls:
+                try:
+                    yield key, method(*args), None
+                except Exception as e:
+                    yield key, None, e
+            return
+
+        futures = {self._rest_pool.submit(method, *args): key for key, args in calls}
+        for future in concurrent.futures.as_completed(futures):
+            error = future.exception()
+            yield futures[future], None if error else future.result(), error
 
     def private_end_point(self, type, endpoint, params):
         '''
@@ -306,20 +502,188 @@ class CCXTBroker(with_metaclass(MetaCCXTBroker, BrokerBase)):
 
         print(dir(ccxt.hitbtc()))
         '''
-        endpoint_str = endpoint.replace('/', '_')
-        endpoint_str = endpoint_str.replace('{', '')
-        endpoint_str = endpoint_str.replace('}', '')
-
-        method_str = 'private_' + type.lower() + endpoint_str.lower()
+        method_str = 'private_' + type.lower() + endpoint.translate(_ENDPOINT_TABLE).lower()
 
         return self.store.private_end_point(type=type, endpoint=method_str, params=params)
 
 
-    # Mapping of message: https://binance-docs.github.io/apidocs/futures/en/#event-order-update
     def push_trade_message(self, msg):
         if not self.store.exchange.id == BINANCEUSDM:
             return
 
+        self._msg_buffer.append(msg)
+        self._msg_event.set()
+
+    def _consume_trade_messages(self):
+        while self._msg_running:
+            self._msg_event.wait()
+            # Give the rest of a burst of fills a chance to arrive
+            time.sleep(self._msg_max_wait)
+            self._msg_event.clear()
+
+            msgs = []
+            while self._msg_buffer:
+                msgs.append(self._msg_buffer.popleft())
+
+            if not msgs:
+                continue
+
+            # Only local order/position state is touched under the lock
+            executed = {}
+            notifications = []
+            with self._orders_lock:
+                for msg in msgs:
+                    try:
+                        order = self._process_trade_message(msg)
+                    except Exception as e:
+                        # A bad message must not stop the processing of later fills
+                        if self.debug:
+                            print('{} - Failed to process trade message {}: {!r}'.format(datetime.now(), msg, e))
+                        continue
+                    if order is not None:
+                        executed[order.ccxt_order['id']] = (order, order.data.p.dataname)
+                        notifications.append(order.clone())
+
+            # REST calls happen outside the lock so order submission and
+            # cancellation are not held up. One trades query per order; wallet
+            # balance and value arrive separately through push_account_update.
+            for order_id, (order, symbol) in executed.items():
+                try:
+                    order.ccxt_order['trades'] = self.get_order_trades(order_id, symbol)
+                except Exception as e:
+                    print('{} - Failed to fetch trades of order {}: {!r}'.format(datetime.now(), order_id, e))
+
+            # The available balance is not part of ACCOUNT_UPDATE, refresh it
+            # over REST once the TTL ran out
+            if executed:
+                self.get_balance()
+
+            # Notify only now so that the trades are attached. The clones share
+            # the order's ccxt_order dict and therefore see them.
+            self.notifs.extend(notifications)
+
+    def _poll_open_orders(self):
+        interval = self._poll_interval
+        while not self._poll_stop.wait(interval):
+            try:
+                changed = self._refresh_open_orders()
+            except Exception as e:
+                # Keep polling for the rest of the session
+                changed = False
+                if self.debug:
+                    print('{} - Order polling failed: {!r}'.format(datetime.now(), e))
+
+            if changed:
+                interval = self._poll_interval
+            else:
+                interval = min(interval * 1.5, self._poll_max)
+
+    def _refresh_open_orders(self):
+        with self._orders_lock:
+            orders = list(self.open_orders.items())
+
+        calls = [((oID, order), (oID, order.data.p.dataname)) for oID, order in orders]
+
+        changed = False
+        for (oID, order), ccxt_order, error in self._rest_calls(self.store.fetch_order, calls):
+            try:
+                if error is not None:
+                    raise error
+                with self._orders_lock:
+                    changed |= self._update_polled_order(oID, order, ccxt_order)
+            except Exception as e:
+                if self.debug:
+                    print('{} - Failed to refresh order {}: {!r}'.format(datetime.now(), oID, e))
+
+        if changed:
+            self.get_balance()
+        return changed
+
+    def _update_polled_order(self, oID, order, ccxt_order):
+        if oID not in self.open_orders:
+            return False
+
+        # Book whatever was filled since the last poll, also for orders that
+        # were cancelled after a partial fill
+        filled = self._execute_polled_fill(order, ccxt_order)
+        order.ccxt_order = ccxt_order
+
+        status = ccxt_order.get('status')
+        if ccxt_order.get(self._closed_key) == self._closed_val:
+            self.open_orders.pop(oID)
+            order.completed()
+        elif status == 'canceled':
+            self.open_orders.pop(oID)
+            order.cancel()
+        elif status == 'expired':
+            self.open_orders.pop(oID)
+            order.expire()
+        elif status == 'rejected':
+            self.open_orders.pop(oID)
+            order.reject()
+        elif filled:
+            order.partial()
+        else:
+            return False
+
+        self.notify(order)
+        return True
+
+    def _execute_polled_fill(self, order, ccxt_order):
+        # ccxt reports cumulative filled amount, cost and fee for the order.
+        # The difference with the fills already executed is the new fill.
+        prev_amount = sum(fill['amount'] for fill in order.executed_fills)
+        prev_cost = sum(fill['cost'] for fill in order.executed_fills)
+        prev_fee = sum(fill['fee'] for fill in order.executed_fills)
+
+        amount = (ccxt_order.get('filled') or 0) - prev_amount
+        if amount <= 0:
+            return False
+
+        if ccxt_order.get('cost'):
+            price = (ccxt_order['cost'] - prev_cost) / amount
+        else:
+            price = ccxt_order['average'] or ccxt_order['price'] or order.price
+
+        fee = ccxt_order.get('fee') or {}
+        comm = (fee.get('cost') or 0) - prev_fee
+
+        order.executed_fills.append({'amount': amount, 'cost': amount * price, 'fee': comm})
+
+        data = order.data
+        pos = self.getposition(data, clone=False)
+        pprice_orig = pos.price
+        size = amount if order.isbuy() else -amount
+        psize, pprice, opened, closed = pos.update(size, price)
+
+        comminfo = self._getcomminfo(data)
+
+        # A fill that reverses the position pays its commission once, split
+        # between the closed and the opened part
+        closedcomm = comm * abs(closed) / (abs(closed) + abs(opened))
+        openedcomm = comm - closedcomm
+        closedvalue = price * closed
+        openedvalue = price * opened
+
+        margin = comminfo.margin or 0
+        pnl = comminfo.profitandloss(-closed, pprice_orig, price)
+
+        order.execute(ccxt_order['datetime'], closed + opened, price,
+                      closed, closedvalue, closedcomm,
+                      opened, openedvalue, openedcomm,
+                      margin, pnl, psize, pprice)
+        order.addcomminfo(comminfo)
+        return True
+
+    def _getcomminfo(self, data):
+        # Keyed like getcommissioninfo, which resolves the info by data name
+        comminfo = self._comminfo_cache.get(data._name)
+        if comminfo is None:
+            comminfo = self._comminfo_cache[data._name] = self.getcommissioninfo(data)
+        return comminfo
+
+    # Mapping of message: https://binance-docs.github.io/apidocs/futures/en/#event-order-update
+    def _process_trade_message(self, msg):
         '''
         CCXT Order Structure
         {'amount': 0.1,
@@ -368,125 +732,174 @@ class CCXTBroker(with_metaclass(MetaCCXTBroker, BrokerBase)):
         # print("===== trade message received in broker")
         # pprint(msg)
 
-        with self._lock_orders:
-            pushed_order = msg['o']
-            # E.g. FILLED, PARTIALLY_FILLED or NEW
-            status = pushed_order['X']
-            # E.g. TRADE or NEW
-            exec_type = pushed_order['x']
+        TRADE, FILLED, PARTIALLY_FILLED = self.TRADE, self.FILLED, self.PARTIALLY_FILLED
 
-            order_id = str(pushed_order['i'])
+        pushed_order = msg['o']
+        # E.g. FILLED, PARTIALLY_FILLED or NEW
+        status = pushed_order['X']
+        # E.g. TRADE or NEW
+        exec_type = pushed_order['x']
 
-            if order_id not in self.open_orders:
-                if self.debug:
-                    print("===== Invalid order id:, ", order_id)
-                return
+        order_id = str(pushed_order['i'])
 
+        order = self.open_orders.get(order_id) or self._canceled_orders.get(order_id)
+        if order is None:
             if self.debug:
-                print("====== Execute: ", status)
+                print("===== Invalid order id:, ", order_id)
+            return
 
-            order = self.open_orders[order_id]
+        if self.debug:
+            print("====== Execute: ", status)
 
-            if exec_type != self.TRADE:
-                if self.debug:
-                    print("===== Non-trade order of type: ", exec_type)
-                return
+        if exec_type != TRADE:
+            if self.debug:
+                print("===== Non-trade order of type: ", exec_type)
+            return
 
-            if status != self.FILLED and status != self.PARTIALLY_FILLED:
-                if self.debug:
-                    print("====== Neither filled nor partially filled. staus: ", status)
-                return
+        if status != FILLED and status != PARTIALLY_FILLED:
+            if self.debug:
+                print("====== Neither filled nor partially filled. staus: ", status)
+            return
 
-            # position_response = self.store.exchange.fapiPrivate_get_positionrisk ({
-            #     'symbol': "BTCUSDT"
-            # })
-            # print("Retrieved response in ccxt broker")
-            # pprint(position_response)
+        # position_response = self.store.exchange.fapiPrivate_get_positionrisk ({
+        #     'symbol': "BTCUSDT"
+        # })
+        # print("Retrieved response in ccxt broker")
+        # pprint(position_response)
 
-            data = order.data
-            pos = self.getposition(data, clone=False)
+        data = order.data
+        pos = self.getposition(data, clone=False)
 
-            side = pushed_order['S']
-            size = float(pushed_order['l']) if side == self.BUY else -float(pushed_order['l'])
-            price = float(pushed_order['L'])
+        # Last filled price/quantity, commission and realized profit of this fill
+        last_price = float(pushed_order['L'])
+        last_qty = float(pushed_order['l'])
+        comm = float(pushed_order['n']) if 'n' in pushed_order else 0.0
+        pnl = float(pushed_order['rp'])
 
-            # psize, pprice, opened, closed = pos.update(order.size, order.price)
-            psize, pprice, opened, closed = pos.update(size, price)
-            if self.debug:
-                txt = colored(f"position in push_trade_message: ", 'red')
-                print(txt)
-                print(self.getposition(order.data, clone=False))
-
-            comminfo = self.getcommissioninfo(order.data)
-
-            if closed:
-                closedvalue = float(pushed_order['L']) * closed
-                if 'n' in pushed_order:
-                    closedcomm = float(pushed_order['n'])
-                else:
-                    closedcomm = 0
-            else:
-                closedvalue = closedcomm = 0
-            
-            if opened:
-                openedvalue = float(pushed_order['L']) * opened
-                if 'n' in pushed_order:
-                    openedcomm = float(pushed_order['n'])
-                else:
-                    openedcomm = 0
-            else:
-                openedvalue = openedcomm = 0
+        side = pushed_order['S']
+        size = last_qty if side == self.BUY else -last_qty
 
-            if status == self.PARTIALLY_FILLED:
-                order.partial()
-            elif status == self.FILLED:
-                order.completed()
+        # psize, pprice, opened, closed = pos.update(order.size, order.price)
+        psize, pprice, opened, closed = pos.update(size, last_price)
+        if self.debug:
+            print(colored("position in push_trade_message: ", 'red'))
+            print(pos)
 
-            ccxt_order_trades = self.get_order_trades(order_id, order.data.p.dataname)
-            order.ccxt_order['trades'] = ccxt_order_trades
+        comminfo = self._getcomminfo(data)
 
-            margin = 0
-            if comminfo.margin:
-                margin = comminfo['margin'] if comminfo['margin'] is not None else 0
+        # A fill that reverses the position pays its commission once, split
+        # between the closed and the opened part
+        closedcomm = comm * abs(closed) / (abs(closed) + abs(opened))
+        openedcomm = comm - closedcomm
+        closedvalue = last_price * closed
+        openedvalue = last_price * opened
 
-            execsize = closed + opened
-            # Realized profit
-            pnl = float(pushed_order['rp'])
+        if order_id in self._canceled_orders:
+            # Filled before the cancel went through, book it but keep the status
+            pass
+        elif status == PARTIALLY_FILLED:
+            order.partial()
+        elif status == FILLED:
+            order.completed()
 
-            if self.debug:
-                print("====== Pushed Order in push trade message =======")
-                pprint(pushed_order)
-
-                print("====== order exec =======")
-                print("psize", psize)
-                print("pprice", pprice)
-                print("opened", opened)
-                print("closed", closed)
-                print("execsize (opened+closed): ", execsize)
-                print("amount", order.ccxt_order['amount'])
-
-            '''
-            def execute(self, dt, size, price,
-            closed, closedvalue, closedcomm,
-            opened, openedvalue, openedcomm,
+        margin = 0
+        if comminfo.margin:
+            margin = comminfo['margin'] if comminfo['margin'] is not None else 0
+
+        execsize = closed + opened
+
+        if self.debug:
+            print("====== Pushed Order in push trade message =======")
+            pprint(pushed_order)
+
+            print("====== order exec =======",
+                  "psize {}".format(psize),
+                  "pprice {}".format(pprice),
+                  "opened {}".format(opened),
+                  "closed {}".format(closed),
+                  "execsize (opened+closed): {}".format(execsize),
+                  "amount {}".format(order.ccxt_order['amount']),
+                  sep='\n')
+
+        '''
+        def execute(self, dt, size, price,
+        closed, closedvalue, closedcomm,
+        opened, openedvalue, openedcomm,
+        margin, pnl,
+        psize, pprice):
+        '''
+        order.execute(
+            order.ccxt_order['datetime'], 
+            # order['amount'], 
+            execsize,
+            # order.ccxt_order['price'], 
+            last_price,
+            closed, closedvalue, closedcomm, 
+            opened, openedvalue, openedcomm, 
             margin, pnl,
-            psize, pprice):
-            '''
-            order.execute(
-                order.ccxt_order['datetime'], 
-                # order['amount'], 
-                execsize,
-                # order.ccxt_order['price'], 
-                price,
-                closed, closedvalue, closedcomm, 
-                opened, openedvalue, openedcomm, 
-                margin, pnl,
-                psize, pprice
-            )
-            order.addcomminfo(comminfo)
-            self.notify(order)
-            
-            self.get_balance()
+            psize, pprice
+        )
+        order.addcomminfo(comminfo)
+
+        # Notified by _consume_trade_messages once the order's trades are fetched
+        return order
+
+    # Mapping of message: https://binance-docs.github.io/apidocs/futures/en/#event-balance-and-position-update
+    def push_account_update(self, msg):
+        '''
+        Balance and position update pushed on the user data stream. Keeps
+        cash/value current without polling the balance over REST.
+
+        {'e': 'ACCOUNT_UPDATE',
+        'a': {'m': 'ORDER',
+              'B': [{'a': 'USDT', 'wb': '122624.12345678', 'cw': '100.12345678', 'bc': '50.12345678'}],
+              'P': [{'s': 'BTCUSDT', 'pa': '0', 'ep': '0.00000', 'cr': '200', 'up': '0',
+                     'mt': 'isolated', 'iw': '0.00000000', 'ps': 'BOTH'}]}}
+
+        cash and value keep the meaning they have after a REST get_balance,
+        ccxt's free (available) and total (margin) balance:
+
+        - value is the wallet balance plus the unrealized profit of the
+          positions. The event only lists the positions it affects, so the
+          last reported unrealized profit of every position is kept.
+        - The available balance is not part of the event. cash is moved by
+          the change of the wallet balance (realized profit, fees, funding)
+          between two events; margin locked by orders only shows after the
+          next REST refresh.
+        '''
+        if not self.store.exchange.id == BINANCEUSDM:
+            return
+
+        update = msg['a']
+
+        with self._orders_lock:
+            for position in update['P']:
+                # Positions of markets settled in other assets do not count towards value
+                market = self.store.exchange.safe_market(position['s'])
+                if (market.get('settle') or market.get('quote')) == self.currency:
+                    self._unrealized[position['s'], position['ps']] = float(position['up'])
+
+            for balance in update['B']:
+                if balance['a'] == self.currency:
+                    wallet_balance = float(balance['wb'])
+                    if self._wallet_balance is not None:
+                        self.store._cash += wallet_balance - self._wallet_balance
+                    self._wallet_balance = wallet_balance
+                    self.store._value = wallet_balance + sum(self._unrealized.values())
+
+            # Position changes caused by orders are applied from the fills in
+            # _process_trade_message. Only sync the others (funding, liquidation, ...)
+            # so that a fill is never counted twice.
+            if update['m'] != 'ORDER':
+                for position in update['P']:
+                    # Positions are kept per data name, as in getposition
+                    name = self._market_names.get(position['s'])
+                    if name is None:
+                        continue
+                    pos = self.positions.get(name)
+                    if pos is None:
+                        pos = self.positions[name] = Position()
+                    pos.set(float(position['pa']), float(position['ep']))
 
     def get_order_trades(self, order_id, symbol):
         '''
@@ -523,7 +936,4 @@ class CCXTBroker(with_metaclass(MetaCCXTBroker, BrokerBase)):
             'type': None
         }
         '''
-        ccxt_my_trades = self.store.fetch_my_trades(symbol)
-        # order_trades = list(filter(lambda d: d['order'] in ccxt_my_trades))
-        order_trades = [d for d in ccxt_my_trades if d['order'] == order_id]
-        return order_trades
\ No newline at end of file
+        return self.store.fetch_order_trades(order_id, symbol)
@@ -22,6 +22,7 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
 import sys
+import threading
 import time
 from datetime import datetime
 from functools import wraps
@@ -34,10 +35,25 @@ from binance import ThreadedWebsocketManager
 
 from backtrader.metabase import MetaParams
 from backtrader.utils.py3 import with_metaclass
-from ccxt.base.errors import NetworkError, ExchangeError
+from ccxt.base.errors import NetworkError, ExchangeError, InvalidOrder, NotSupported, OrderNotFound
 
 BINANCEUSDM = 'binanceusdm'
 
+# Params sent unchanged by both the unified create_order and the fast path.
+# 'created' is the creation timestamp the broker adds to every order.
+_FAST_ORDER_PARAMS = frozenset(('created', 'newClientOrderId', 'positionSide'))
+
+# Binance futures order status to the ccxt unified status
+_BINANCE_ORDER_STATUS = {
+    'NEW': 'open',
+    'PARTIALLY_FILLED': 'open',
+    'FILLED': 'closed',
+    'CANCELED': 'canceled',
+    'PENDING_CANCEL': 'canceling',
+    'REJECTED': 'rejected',
+    'EXPIRED': 'expired',
+}
+
 class MetaSingleton(MetaParams):
     '''Metaclass to make a metaclassed class a singleton'''
 
@@ -117,6 +133,11 @@ class CCXTStore(with_metaclass(MetaSingleton, object)):
         self.retries = retries
         self.debug = debug
 
+        self._market_ids = {}  # unified symbol -> exchange market id
+
+        self._keepalive_stop = threading.Event()
+        self._keepalive_thread = None
+
         if balance_type:
             balance_type_dict = {'type': balance_type}
             balance = self.exchange.fetch_balance(balance_type_dict) if 'secret' in config else 0
@@ -146,11 +167,39 @@ class CCXTStore(with_metaclass(MetaSingleton, object)):
     def handle_binance_socket_message(self, msg):
         if msg['e'] == 'ORDER_TRADE_UPDATE':
             self.broker.push_trade_message(msg)
+        elif msg['e'] == 'ACCOUNT_UPDATE':
+            self.broker.push_account_update(msg)
     
     def start(self, broker):
         self.broker = broker
 
+    def start_keepalive(self, interval=25):
+        '''
+        Ping the exchange every ``interval`` seconds so the pooled HTTPS
+        connection of the ccxt session stays open and orders do not pay for a
+        new TLS handshake after the connection has idled.
+        '''
+        if self._keepalive_thread is not None or not self.exchange.has.get('fetchTime'):
+            return
+
+        self._keepalive_stop.clear()
+        self._keepalive_thread = threading.Thread(target=self._keepalive, args=(interval,), daemon=True)
+        self._keepalive_thread.start()
+
+    def _keepalive(self, interval):
+        while not self._keepalive_stop.wait(interval):
+            try:
+                self.exchange.fetch_time()
+            except (NetworkError, ExchangeError):
+                if self.debug:
+                    print('{} - keepalive ping failed'.format(datetime.now()))
+
     def stop(self):
+        if self._keepalive_thread is not None:
+            self._keepalive_stop.set()
+            self._keepalive_thread.join()
+            self._keepalive_thread = None
+
         try:
             if self.exchange.id == BINANCEUSDM:
                 self.twm.stop()  # disconnect should be an invariant
@@ -183,6 +232,10 @@ class CCXTStore(with_metaclass(MetaSingleton, object)):
                 time.sleep(self.exchange.rateLimit / 1000)
                 try:
                     return method(self, *args, **kwargs)
+                except (OrderNotFound, InvalidOrder, NotSupported):
+                    # e.g. cancelling an order that was filled meanwhile,
+                    # another attempt would fail the same way
+                    raise
                 except (NetworkError, ExchangeError):
                     if i == self.retries - 1:
                         raise
@@ -203,6 +256,7 @@ class CCXTStore(with_metaclass(MetaSingleton, object)):
         # Fix if None is returned
         self._cash = cash if cash else 0
         self._value = value if value else 0
+        return balance
 
     @retry
     def getposition(self):
@@ -215,6 +269,57 @@ class CCXTStore(with_metaclass(MetaSingleton, object)):
         return self.exchange.create_order(symbol=symbol, type=order_type, side=side,
                                           amount=amount, price=price, params=params)
 
+    @retry
+    def fast_create_order(self, symbol, order_type, side, amount, price, params):
+        '''
+        Place market and limit orders on Binance USD-M through the implicit
+        endpoint, skipping ccxt's unified request building and response
+        parsing. Only the fields the broker uses are mapped back. Any other
+        exchange or order type, and any param that ccxt would translate
+        (postOnly, stopPrice, ...), goes through the unified create_order.
+        '''
+        if self.exchange.id != BINANCEUSDM or order_type not in ('market', 'limit') or \
+                not _FAST_ORDER_PARAMS.issuperset(params):
+            return self.exchange.create_order(symbol=symbol, type=order_type, side=side,
+                                              amount=amount, price=price, params=params)
+
+        market_id = self._market_ids.get(symbol)
+        if market_id is None:
+            market_id = self._market_ids[symbol] = self.exchange.market_id(symbol)
+
+        request = {
+            'symbol': market_id,
+            'side': side.upper(),
+            'type': order_type.upper(),
+            'quantity': self.exchange.amount_to_precision(symbol, amount),
+        }
+        if order_type == 'limit':
+            request['price'] = self.exchange.price_to_precision(symbol, price)
+            request['timeInForce'] = 'GTC'
+        request.update(params)
+
+        response = self.exchange.fapiPrivatePostOrder(request)
+
+        timestamp = int(response['updateTime'])
+        amount = float(response['origQty'])
+        filled = float(response['executedQty'])
+        return {
+            'id': str(response['orderId']),
+            'clientOrderId': response['clientOrderId'],
+            'timestamp': timestamp,
+            'datetime': self.exchange.iso8601(timestamp),
+            'symbol': symbol,
+            'type': order_type,
+            'side': side,
+            'price': float(response['price']) or None,
+            'average': float(response['avgPrice']) or None,
+            'amount': amount,
+            'filled': filled,
+            'remaining': amount - filled,
+            'status': _BINANCE_ORDER_STATUS.get(response['status'], response['status']),
+            'info': response,
+        }
+
     @retry
     def cancel_order(self, order_id, symbol):
         return self.exchange.cancel_order(order_id, symbol)
@@ -227,6 +332,20 @@ class CCXTStore(with_metaclass(MetaSingleton, object)):
     def fetch_my_trades(self, symbol):
         return self.exchange.fetch_my_trades(symbol)
 
+    @retry
+    def fetch_order_trades(self, order_id, symbol):
+        # Query only the fills of this order rather than the whole trade history.
+        # binanceusdm advertises fetchOrderTrades but only supports it on spot
+        # markets, so it has to go through the orderId filter of fetch_my_trades
+        if self.exchange.id == BINANCEUSDM:
+            return self.exchange.fetch_my_trades(symbol, params={'orderId': int(order_id)})
+        if self.exchange.has.get('fetchOrderTrades'):
+            try:
+                return self.exchange.fetch_order_trades(order_id, symbol)
+            except NotSupported:
+                pass
+        return [d for d in self.exchange.fetch_my_trades(symbol) if d['order'] == order_id]
+
     @retry
     def fetch_ohlcv(self, symbol, timeframe, since, limit, params={}):
         if self.debug:
@@ -238,8 +357,8 @@ class CCXTStore(with_metaclass(MetaSingleton, object)):
         return self.exchange.fetch_order(oid, symbol)
 
     @retry
-    def fetch_open_orders(self):
-        return self.exchange.fetchOpenOrders()
+    def fetch_open_orders(self, symbol=None):
+        return self.exchange.fetchOpenOrders(symbol)
 
     @retry
     def private_end_point(self, type, endpoint, params):
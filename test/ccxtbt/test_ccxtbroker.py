@@ -0,0 +1,413 @@
+import time as _time
+import unittest
+from datetime import datetime, time
+from unittest.mock import MagicMock
+
+from backtrader import CommInfoBase, Order
+from ccxt.base.errors import OrderNotFound
+from backtrader.utils.date import date2num
+
+from ccxtbt import CCXTBroker, CCXTStore
+from ccxtbt.ccxtbroker import CCXTOrder
+
+
+def make_broker(exchange_id='kraken', **kwargs):
+    """
+    Create a broker on top of a mocked store. The store is a singleton, so
+    setting the instance makes the broker pick it up instead of connecting.
+    """
+    store = MagicMock()
+    store.exchange.id = exchange_id
+    store.currency = 'USDT'
+    store._cash = 1000.0
+    store._value = 1000.0
+    CCXTStore._singleton = store
+    return CCXTBroker(**kwargs), store
+
+
+def make_data(dataname='BTC/USDT'):
+    dt = datetime(2021, 7, 1)
+    data = MagicMock()
+    data.p.dataname = dataname
+    data._dataname = dataname
+    data._name = dataname
+    data.p.sessionend = time(23, 59, 59, 999990)
+    data.close.__getitem__.return_value = 100.0
+    data.datetime.__getitem__.return_value = date2num(dt)
+    data.datetime.datetime.return_value = dt
+    data.date2num = date2num
+    return data
+
+
+def make_order(broker, data, oid='1', side='buy', amount=2.0):
+    order = CCXTOrder(None, data, {'id': oid, 'side': side, 'amount': amount, 'price': 100.0,
+                                   'datetime': '2021-07-01T00:00:00.000Z'})
+    broker.open_orders[oid] = order
+    return order
+
+
+def ccxt_order(status, filled, cost, fee, oid='1'):
+    return {'id': oid, 'status': status, 'filled': filled, 'cost': cost,
+            'average': cost / filled if filled else None, 'price': 100.0,
+            'fee': {'cost': fee, 'currency': 'USDT'},
+            'datetime': '2021-07-01T00:00:00.000Z'}
+
+
+class TestPollOpenOrders(unittest.TestCase):
+    """
+    Exchanges without a websocket feed of fills (everything but Binance USD-M)
+    find out about fills by polling their open orders over REST.
+    """
+
+    def setUp(self):
+        self.broker, self.store = make_broker()
+        self.data = make_data()
+
+    def tearDown(self):
+        CCXTStore._singleton = None
+
+    def test_partial_fill_then_cancel(self):
+        order = make_order(self.broker, self.data)
+
+        self.store.fetch_order.return_value = ccxt_order('open', 1.0, 100.0, 0.1)
+        self.assertTrue(self.broker._refresh_open_orders())
+        self.assertEqual(order.status, Order.Partial)
+        self.assertEqual(self.broker.getposition(self.data).size, 1.0)
+        self.assertAlmostEqual(order.executed.comm, 0.1)
+
+        # Filled a bit more before the cancel went through
+        self.store.fetch_order.return_value = ccxt_order('canceled', 1.5, 151.0, 0.15)
+        self.assertTrue(self.broker._refresh_open_orders())
+        self.assertEqual(order.status, Order.Canceled)
+        self.assertNotIn('1', self.broker.open_orders)
+
+        pos = self.broker.getposition(self.data)
+        self.assertEqual(pos.size, 1.5)
+        self.assertAlmostEqual(pos.price, 151.0 / 1.5)
+        self.assertAlmostEqual(order.executed.size, 1.5)
+        self.assertAlmostEqual(order.executed.comm, 0.15)
+
+        notified = [self.broker.get_notification().status for _ in range(2)]
+        self.assertEqual(notified, [Order.Partial, Order.Canceled])
+
+    def test_completed_sell(self):
+        order = make_order(self.broker, self.data, side='sell')
+
+        self.store.fetch_order.return_value = ccxt_order('closed', 2.0, 200.0, 0.2)
+        self.assertTrue(self.broker._refresh_open_orders())
+        self.assertEqual(order.status, Order.Completed)
+        self.assertEqual(self.broker.getposition(self.data).size, -2.0)
+        self.assertNotIn('1', self.broker.open_orders)
+        self.store.get_balance.assert_called_once()
+
+    def test_rejected(self):
+        order = make_order(self.broker, self.data)
+
+        self.store.fetch_order.return_value = ccxt_order('rejected', 0.0, 0.0, 0.0)
+        self.assertTrue(self.broker._refresh_open_orders())
+        self.assertEqual(order.status, Order.Rejected)
+        self.assertNotIn('1', self.broker.open_orders)
+        self.assertEqual(self.broker.get_notification().status, Order.Rejected)
+
+    def test_no_polling_without_fetch_order(self):
+        self.store.exchange.has = {'fetchOrder': False}
+        self.broker.start()
+        try:
+            self.assertIsNone(self.broker._poll_thread)
+        finally:
+            self.broker.stop()
+
+    def test_reversal_pays_commission_once(self):
+        self.broker.getposition(self.data, clone=False).set(-1.0, 100.0)
+        order = make_order(self.broker, self.data)
+
+        self.store.fetch_order.return_value = ccxt_order('closed', 2.0, 200.0, 0.2)
+        self.assertTrue(self.broker._refresh_open_orders())
+        self.assertEqual(self.broker.getposition(self.data).size, 1.0)
+        self.assertAlmostEqual(order.executed.comm, 0.2)
+
+    def test_commission_info_by_data_name(self):
+        comminfo = CommInfoBase(commission=0.001)
+        self.broker.addcommissioninfo(comminfo, name='perp')
+        perp = make_data()
+        perp._name = 'perp'
+
+        self.assertIsNot(self.broker._getcomminfo(self.data), comminfo)
+        self.assertIs(self.broker._getcomminfo(perp), comminfo)
+
+    def test_unchanged_order_with_cancel_response_mapping(self):
+        """
+        The samples map canceled orders on the 'result' key of the cancel
+        response, which fetch_order results do not have.
+        """
+        self.broker._canceled_key = 'result'
+        self.broker._canceled_val = 1
+        order = make_order(self.broker, self.data)
+
+        self.store.fetch_order.return_value = ccxt_order('open', 0.0, 0.0, 0.0)
+        self.assertFalse(self.broker._refresh_open_orders())
+        self.assertIn('1', self.broker.open_orders)
+        self.assertIsNone(self.broker.get_notification())
+        self.assertEqual(order.executed.size, 0)
+
+    def test_balance_refresh_is_throttled(self):
+        make_order(self.broker, self.data, oid='1')
+        make_order(self.broker, self.data, oid='2')
+        self.store.fetch_order.side_effect = lambda oid, symbol: ccxt_order('open', 1.0, 100.0, 0.1, oid=oid)
+        self.assertTrue(self.broker._refresh_open_orders())
+        self.store.get_balance.assert_called_once()
+
+        # Within the TTL the balance is not fetched again
+        self.store.fetch_order.side_effect = lambda oid, symbol: ccxt_order('open', 1.5, 150.0, 0.15, oid=oid)
+        self.assertTrue(self.broker._refresh_open_orders())
+        self.store.get_balance.assert_called_once()
+
+        self.broker._balance_ts = _time.monotonic() - self.broker._balance_ttl
+        self.store.fetch_order.side_effect = lambda oid, symbol: ccxt_order('open', 2.0, 200.0, 0.2, oid=oid)
+        self.assertTrue(self.broker._refresh_open_orders())
+        self.assertEqual(self.store.get_balance.call_count, 2)
+
+    def test_failed_fetch_does_not_stop_other_orders(self):
+        make_order(self.broker, self.data, oid='1')
+        make_order(self.broker, self.data, oid='2')
+
+        def fetch_order(oid, symbol):
+            if oid == '1':
+                raise Exception('fetch failed')
+            return ccxt_order('closed', 2.0, 200.0, 0.2, oid=oid)
+
+        self.store.fetch_order.side_effect = fetch_order
+        self.assertTrue(self.broker._refresh_open_orders())
+        self.assertIn('1', self.broker.open_orders)
+        self.assertNotIn('2', self.broker.open_orders)
+
+    def test_parallel_refresh(self):
+        self.broker._rest_workers = 4
+        self.broker.start()
+        try:
+            for oid in ('1', '2', '3'):
+                make_order(self.broker, self.data, oid=oid)
+            self.store.fetch_order.side_effect = lambda oid, symbol: ccxt_order('closed', 2.0, 200.0, 0.2, oid=oid)
+            self.assertTrue(self.broker._refresh_open_orders())
+            self.assertEqual(self.broker.open_orders, {})
+        finally:
+            self.broker.stop()
+
+    def test_get_orders_open_after_stop(self):
+        self.broker._rest_workers = 4
+        self.broker.start()
+        self.broker.stop()
+
+        self.store.fetch_open_orders.side_effect = lambda symbol: [{'id': symbol}]
+        open_orders = self.broker.get_orders_open(symbols=['BTC/USDT', 'ETH/USDT'])
+        self.assertEqual(sorted(o['id'] for o in open_orders), ['BTC/USDT', 'ETH/USDT'])
+
+    def test_backoff(self):
+        self.broker._poll_interval = 1.0
+        self.broker._poll_max = 3.0
+        self.broker._refresh_open_orders = MagicMock(
+            side_effect=[False, False, True, Exception('boom'), False, False, False])
+
+        intervals = []
+
+        def wait(interval):
+            intervals.append(interval)
+            return len(intervals) > 7
+
+        self.broker._poll_stop = MagicMock()
+        self.broker._poll_stop.wait.side_effect = wait
+
+        self.broker._poll_open_orders()
+        self.assertEqual(intervals, [1.0, 1.5, 2.25, 1.0, 1.5, 2.25, 3.0, 3.0])
+
+
+class TestCancel(unittest.TestCase):
+
+    def setUp(self):
+        self.broker, self.store = make_broker()
+        self.data = make_data()
+
+    def tearDown(self):
+        CCXTStore._singleton = None
+
+    def test_cancel(self):
+        order = make_order(self.broker, self.data)
+        self.store.cancel_order.return_value = ccxt_order('canceled', 0.0, 0.0, 0.0)
+
+        self.broker.cancel(order)
+        self.assertEqual(order.status, Order.Canceled)
+        self.assertNotIn('1', self.broker.open_orders)
+        self.store.fetch_order.assert_not_called()
+
+    def test_cancel_books_fill_since_last_poll(self):
+        order = make_order(self.broker, self.data)
+        self.store.cancel_order.return_value = ccxt_order('canceled', 1.0, 100.0, 0.1)
+
+        self.broker.cancel(order)
+        self.assertEqual(order.status, Order.Canceled)
+        self.assertEqual(order.executed.size, 1.0)
+        self.assertEqual(self.broker.getposition(self.data).size, 1.0)
+
+    def test_cancel_filled_order(self):
+        order = make_order(self.broker, self.data)
+        self.store.cancel_order.side_effect = OrderNotFound('Unknown order sent.')
+        self.store.fetch_order.return_value = ccxt_order('closed', 2.0, 200.0, 0.2)
+
+        self.broker.cancel(order)
+        self.assertEqual(order.status, Order.Completed)
+        self.assertNotIn('1', self.broker.open_orders)
+        self.assertEqual(self.broker.getposition(self.data).size, 2.0)
+        self.assertEqual(self.broker.get_notification().status, Order.Completed)
+
+    def test_cancel_filled_order_with_websocket_fills(self):
+        self.store.exchange.id = 'binanceusdm'
+        order = make_order(self.broker, self.data)
+        self.store.cancel_order.side_effect = OrderNotFound('Unknown order sent.')
+        self.store.fetch_order.return_value = ccxt_order('closed', 2.0, 200.0, 0.2)
+
+        self.broker.cancel(order)
+        # The fill is booked when it is reported on the websocket
+        self.assertIn('1', self.broker.open_orders)
+        self.assertIsNone(self.broker.get_notification())
+
+    def test_cancel_already_canceled_order(self):
+        order = make_order(self.broker, self.data)
+        self.store.cancel_order.side_effect = OrderNotFound('Unknown order sent.')
+        self.store.fetch_order.return_value = ccxt_order('canceled', 0.0, 0.0, 0.0)
+
+        self.broker.cancel(order)
+        self.assertEqual(order.status, Order.Canceled)
+        self.assertNotIn('1', self.broker.open_orders)
+        self.assertEqual(self.broker.get_notification().status, Order.Canceled)
+
+    def test_cancel_open_order_error(self):
+        order = make_order(self.broker, self.data)
+        self.store.cancel_order.side_effect = OrderNotFound('Unknown order sent.')
+        self.store.fetch_order.return_value = ccxt_order('open', 0.0, 0.0, 0.0)
+
+        with self.assertRaises(OrderNotFound):
+            self.broker.cancel(order)
+        self.assertIn('1', self.broker.open_orders)
+
+
+class TestTradeMessages(unittest.TestCase):
+    """
+    Binance USD-M pushes fills on the websocket. They are buffered and
+    processed in batches by a consumer thread.
+    """
+
+    def setUp(self):
+        self.broker, self.store = make_broker(exchange_id='binanceusdm')
+        self.broker._msg_max_wait = 0
+        self.data = make_data()
+
+    def tearDown(self):
+        self.broker.stop()
+        CCXTStore._singleton = None
+
+    def wait_for_notification(self):
+        for _ in range(100):
+            if self.broker.notifs:
+                return self.broker.get_notification()
+            _time.sleep(0.01)
+        self.fail('No notification received')
+
+    def test_bad_message_does_not_stop_processing(self):
+        trades = [{'id': 't1', 'order': '1', 'amount': 2.0}]
+        self.store.fetch_order_trades.return_value = trades
+        order = make_order(self.broker, self.data)
+        self.broker.start()
+
+        self.broker.push_trade_message({'o': {}})
+        self.broker.push_trade_message({'o': {'i': 1, 'X': 'FILLED', 'x': 'TRADE', 'S': 'BUY',
+                                              'l': '2', 'L': '100', 'n': '0.2', 'rp': '0'}})
+
+        notified = self.wait_for_notification()
+        self.assertEqual(notified.status, Order.Completed)
+        # Trades are attached before the strategy is notified
+        self.assertEqual(notified.ccxt_order['trades'], trades)
+        self.assertEqual(order.executed.size, 2.0)
+        self.assertEqual(self.broker.getposition(self.data).size, 2.0)
+
+    def test_fill_after_cancel_is_booked(self):
+        order = make_order(self.broker, self.data)
+        self.store.cancel_order.return_value = ccxt_order('canceled', 0.0, 0.0, 0.0)
+        self.broker.cancel(order)
+        self.assertEqual(self.broker.get_notification().status, Order.Canceled)
+        self.broker.start()
+
+        # Sent before the cancel reached the exchange
+        self.broker.push_trade_message({'o': {'i': 1, 'X': 'PARTIALLY_FILLED', 'x': 'TRADE', 'S': 'BUY',
+                                              'l': '1', 'L': '100', 'n': '0.1', 'rp': '0'}})
+
+        notified = self.wait_for_notification()
+        self.assertEqual(notified.status, Order.Canceled)
+        self.assertEqual(order.executed.size, 1.0)
+        self.assertEqual(self.broker.getposition(self.data).size, 1.0)
+
+
+class TestAccountUpdate(unittest.TestCase):
+    """
+    Binance USD-M pushes balance and position changes as ACCOUNT_UPDATE events.
+    """
+
+    def setUp(self):
+        self.broker, self.store = make_broker(exchange_id='binanceusdm')
+        self.store.exchange.market_id.side_effect = lambda symbol: symbol.replace('/', '')
+        self.store.exchange.safe_market.side_effect = lambda market_id: {'quote': market_id[-4:], 'settle': market_id[-4:]}
+        self.store.get_balance.return_value = {'info': {'assets': [{'asset': 'USDT', 'walletBalance': '1000.0'}]}}
+        self.data = make_data()
+
+    def tearDown(self):
+        CCXTStore._singleton = None
+
+    @staticmethod
+    def account_update(reason, wallet_balance, amount, entry_price, unrealized):
+        return {'e': 'ACCOUNT_UPDATE', 'E': 1564745798939, 'T': 1564745798938,
+                'a': {'m': reason,
+                      'B': [{'a': 'USDT', 'wb': wallet_balance, 'cw': wallet_balance, 'bc': '0'},
+                            {'a': 'BUSD', 'wb': '5.0', 'cw': '5.0', 'bc': '0'}],
+                      'P': [{'s': 'BTCUSDT', 'pa': amount, 'ep': entry_price, 'cr': '200',
+                             'up': unrealized, 'mt': 'cross', 'iw': '0', 'ps': 'BOTH'}]}}
+
+    def submit(self):
+        created = {'id': '1', 'status': 'open', 'side': 'buy', 'amount': 2.0, 'filled': 0.0,
+                   'price': 100.0, 'datetime': '2021-07-01T00:00:00.000Z'}
+        self.store.create_order.return_value = created
+        self.store.fast_create_order.return_value = created
+        return self.broker.buy(None, self.data, 2.0, parent=None, transmit=True)
+
+    def test_balance(self):
+        # The wallet balance of the REST snapshot is the reference of the first event
+        self.broker.get_balance(force=True)
+        self.broker.push_account_update(self.account_update('ORDER', '999.0', '2', '100', '10.0'))
+        self.assertEqual(self.broker.getvalue(), 1009.0)
+        self.assertEqual(self.broker.getcash(), 999.0)
+
+        self.broker.push_account_update(self.account_update('FUNDING_FEE', '998.5', '2', '100', '4.0'))
+        self.assertEqual(self.broker.getvalue(), 1002.5)
+        self.assertEqual(self.broker.getcash(), 998.5)
+
+    def test_value_only_counts_positions_settled_in_currency(self):
+        msg = self.account_update('ORDER', '1000.0', '2', '100', '10.0')
+        msg['a']['P'].append({'s': 'BTCBUSD', 'pa': '1', 'ep': '100', 'cr': '0',
+                              'up': '50.0', 'mt': 'cross', 'iw': '0', 'ps': 'BOTH'})
+        self.broker.push_account_update(msg)
+        self.assertEqual(self.broker.getvalue(), 1010.0)
+
+    def test_position_sync_uses_data_name(self):
+        self.submit()
+
+        # Order driven position changes come from the fills
+        self.broker.push_account_update(self.account_update('ORDER', '1000.0', '2', '100', '0'))
+        self.assertEqual(self.broker.getposition(self.data).size, 0)
+
+        self.broker.push_account_update(self.account_update('FUNDING_FEE', '999.0', '1.5', '101', '0'))
+        pos = self.broker.getposition(self.data)
+        self.assertEqual(pos.size, 1.5)
+        self.assertEqual(pos.price, 101.0)
+        self.assertEqual(list(self.broker.positions), ['BTC/USDT'])
+
+
+if __name__ == '__main__':
+    unittest.main()
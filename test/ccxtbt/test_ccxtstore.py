@@ -0,0 +1,149 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+import ccxt
+from ccxt.base.errors import NetworkError, NotSupported, OrderNotFound
+
+from ccxtbt import CCXTStore
+
+
+def make_store(exchange_id='binanceusdm'):
+    """
+    Create a store without running __init__, which would connect to the
+    exchange and open the Binance websockets.
+    """
+    store = object.__new__(CCXTStore)
+    store.exchange = MagicMock()
+    store.exchange.id = exchange_id
+    store.exchange.rateLimit = 0
+    store.exchange.market_id.side_effect = lambda symbol: symbol.replace('/', '')
+    store.exchange.amount_to_precision.side_effect = lambda symbol, amount: str(amount)
+    store.exchange.price_to_precision.side_effect = lambda symbol, price: str(price)
+    store.exchange.iso8601 = ccxt.Exchange.iso8601
+    store.retries = 1
+    store.debug = False
+    store._market_ids = {}
+    return store
+
+
+def binance_response(status, executed_qty, avg_price, price='0'):
+    return {'orderId': 2731578280, 'symbol': 'BTCUSDT', 'status': status,
+            'clientOrderId': 'x-xcKtGhcudb397e43d4127eacb1f16d', 'price': price,
+            'avgPrice': avg_price, 'origQty': '0.100', 'executedQty': executed_qty,
+            'cumQty': executed_qty, 'cumQuote': '0', 'timeInForce': 'GTC', 'type': 'MARKET',
+            'reduceOnly': False, 'closePosition': False, 'side': 'BUY', 'positionSide': 'BOTH',
+            'stopPrice': '0', 'workingType': 'CONTRACT_PRICE', 'priceProtect': False,
+            'origType': 'MARKET', 'updateTime': 1625132022659}
+
+
+class TestFastCreateOrder(unittest.TestCase):
+
+    def test_market_order(self):
+        store = make_store()
+        store.exchange.fapiPrivatePostOrder.return_value = binance_response('FILLED', '0.100', '34687.40000')
+
+        order = store.fast_create_order('BTC/USDT', 'market', 'buy', 0.1, None, {'created': 1})
+
+        store.exchange.fapiPrivatePostOrder.assert_called_once_with(
+            {'symbol': 'BTCUSDT', 'side': 'BUY', 'type': 'MARKET', 'quantity': '0.1', 'created': 1})
+        store.exchange.create_order.assert_not_called()
+        self.assertEqual(order['id'], '2731578280')
+        self.assertEqual(order['status'], 'closed')
+        self.assertEqual(order['side'], 'buy')
+        self.assertEqual(order['amount'], 0.1)
+        self.assertEqual(order['filled'], 0.1)
+        self.assertEqual(order['remaining'], 0.0)
+        self.assertEqual(order['average'], 34687.4)
+        self.assertIsNone(order['price'])
+        self.assertEqual(order['datetime'], '2021-07-01T09:33:42.659Z')
+
+    def test_new_limit_order(self):
+        store = make_store()
+        store.exchange.fapiPrivatePostOrder.return_value = binance_response('NEW', '0', '0.00000', price='30000')
+
+        order = store.fast_create_order('BTC/USDT', 'limit', 'buy', 0.1, 30000, {})
+
+        request = store.exchange.fapiPrivatePostOrder.call_args[0][0]
+        self.assertEqual(request['price'], '30000')
+        self.assertEqual(request['timeInForce'], 'GTC')
+        self.assertEqual(order['status'], 'open')
+        self.assertEqual(order['price'], 30000.0)
+        self.assertIsNone(order['average'])
+        self.assertEqual(order['filled'], 0.0)
+
+    def test_unified_params_use_create_order(self):
+        store = make_store()
+
+        store.fast_create_order('BTC/USDT', 'limit', 'buy', 0.1, 30000, {'postOnly': True})
+
+        store.exchange.fapiPrivatePostOrder.assert_not_called()
+        store.exchange.create_order.assert_called_once()
+
+    def test_other_exchange_uses_create_order(self):
+        store = make_store(exchange_id='kraken')
+
+        store.fast_create_order('BTC/USDT', 'market', 'buy', 0.1, None, {})
+
+        store.exchange.fapiPrivatePostOrder.assert_not_called()
+        store.exchange.create_order.assert_called_once()
+
+
+class TestRetry(unittest.TestCase):
+
+    def test_network_errors_are_retried(self):
+        store = make_store()
+        store.retries = 3
+        store.exchange.cancel_order.side_effect = [NetworkError('timeout'), {'id': '1'}]
+
+        self.assertEqual(store.cancel_order('1', 'BTC/USDT'), {'id': '1'})
+        self.assertEqual(store.exchange.cancel_order.call_count, 2)
+
+    def test_order_not_found_is_not_retried(self):
+        store = make_store()
+        store.retries = 3
+        store.exchange.cancel_order.side_effect = OrderNotFound('Unknown order sent.')
+
+        with self.assertRaises(OrderNotFound):
+            store.cancel_order('1', 'BTC/USDT')
+        store.exchange.cancel_order.assert_called_once()
+
+    def test_not_supported_is_not_retried(self):
+        store = make_store()
+        store.retries = 3
+        store.exchange.cancel_order.side_effect = NotSupported('not supported')
+
+        with self.assertRaises(NotSupported):
+            store.cancel_order('1', 'BTC/USDT')
+        store.exchange.cancel_order.assert_called_once()
+
+
+class TestFetchOrderTrades(unittest.TestCase):
+
+    def test_binanceusdm_filters_by_order_id(self):
+        # A real instance, since binanceusdm advertises fetchOrderTrades but
+        # raises NotSupported for its swap markets
+        store = make_store()
+        store.exchange = ccxt.binanceusdm()
+        store.exchange.rateLimit = 0
+        trades = [{'id': '7', 'order': '2731578280'}]
+
+        with patch.object(store.exchange, 'fetch_my_trades', return_value=trades) as fetch_my_trades, \
+                patch.object(store.exchange, 'fetch_order_trades') as fetch_order_trades:
+            self.assertEqual(store.fetch_order_trades('2731578280', 'BTC/USDT:USDT'), trades)
+
+        fetch_my_trades.assert_called_once_with('BTC/USDT:USDT', params={'orderId': 2731578280})
+        fetch_order_trades.assert_not_called()
+
+    def test_not_supported_falls_back_to_my_trades(self):
+        store = make_store(exchange_id='kraken')
+        store.retries = 3
+        store.exchange.has = {'fetchOrderTrades': True}
+        store.exchange.fetch_order_trades.side_effect = NotSupported('spot markets only')
+        store.exchange.fetch_my_trades.return_value = [{'id': '7', 'order': '1'}, {'id': '8', 'order': '2'}]
+
+        self.assertEqual(store.fetch_order_trades('1', 'BTC/USDT'), [{'id': '7', 'order': '1'}])
+        store.exchange.fetch_order_trades.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()